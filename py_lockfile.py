@@ -1,3 +1,5 @@
+import functools
+import glob
 import json
 import operator
 import os.path
@@ -5,13 +7,19 @@ import platform
 import re
 import subprocess
 import sys
+import threading
 import urllib.parse
 import urllib.error
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 
-import toml
 import argparse
 
+try:
+    import tomllib
+except ImportError:     # Python < 3.11
+    import tomli as tomllib
+
 
 LEGACY_ALIASES = {
     "manylinux1_x86_64": "manylinux_2_5_x86_64",
@@ -27,8 +35,8 @@ LEGACY_ALIASES = {
     "manylinux2014_s390x": "manylinux_2_17_s390x",
 }
 
-# ('glibc', '2.38')
-GLIBC = platform.libc_ver()
+# ('glibc', '2.38'), detected on first use by refresh_env()
+GLIBC = None
 
 # 'x86_64'
 PLATFORM_TYPE = platform.machine()
@@ -48,26 +56,109 @@ else:
 PY_VERSION = (sys.version_info.major, sys.version_info.minor,
               sys.version_info.micro)
 
-MUSL_VERSION = None
-if 'linux' in PLATFORM and not GLIBC[0]:
-    # Musl
-    try:
-        output = subprocess.check_output(
-            ["ldd", "--version"],
-            stderr=subprocess.STDOUT,
-            shell=True
-        )
-    except subprocess.CalledProcessError as ex:
-        # Ignore error
-        output = ex.output
-    for row in output.splitlines():
-        match = re.match(rb'Version (\d+)\.(\d+)\..*', row, re.I)
+
+@functools.lru_cache(maxsize=None)
+def _detect_glibc() -> (str, str):
+    return platform.libc_ver()
+
+
+@functools.lru_cache(maxsize=None)
+def _detect_musl() -> str:
+    """
+    Detect musl version (e.g. '1_2') by running the musl dynamic loader
+    directly, `ldd --version` is used as a fallback.
+    """
+    commands = [[it] for it in sorted(glob.glob('/lib/ld-musl-*.so.1'))]
+    commands.append(['ldd', '--version'])
+    for command in commands:
+        try:
+            output = subprocess.run(command, stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT).stdout
+        except OSError:
+            continue
+        match = re.search(rb'^Version (\d+)\.(\d+)\.', output,
+                          re.I | re.M)
         if match:
-            MUSL_VERSION = f'{int(match.group(1))}_{int(match.group(2))}'
-            break
+            return f'{int(match.group(1))}_{int(match.group(2))}'
+    return None
+
+
+# '1_2', detected on first use by refresh_env()
+MUSL_VERSION = None
+
+# Derived from the values above by refresh_env()
+_ENV_READY = False
+# True
+_IS_LINUX = False
+# True
+_IS_GLIBC = False
+# (2, 38)
+_GLIBC_VERSION = None
+# 'musllinux_1_1_x86_64'
+_MUSL_TAG = None
+# 'x86_64'
+_MANYLINUX_ARCH = None
+# 'cp311'
+_PY_LANG = None
+# 'py3'
+_PY_MAJOR_TAG = None
+# 'abi3'
+_PY_ABI_TAG = None
+# 311
+_PY_NUM = None
+
+
+def refresh_env():
+    """
+    Detect the libc when it is not set yet and recompute the values derived
+    from the current platform settings.
+    """
+    global GLIBC, MUSL_VERSION, _ENV_READY, _IS_LINUX, _IS_GLIBC, \
+        _GLIBC_VERSION, _MUSL_TAG, _MANYLINUX_ARCH, _PY_LANG, _PY_MAJOR_TAG, \
+        _PY_ABI_TAG, _PY_NUM
+    if GLIBC is None:
+        GLIBC = _detect_glibc()
+    if MUSL_VERSION is None and 'linux' in PLATFORM and not GLIBC[0]:
+        # Musl
+        MUSL_VERSION = _detect_musl()
+    _PY_LANG = f'{PYIMPL}{PY_VERSION[0]}{PY_VERSION[1]}'
+    _PY_MAJOR_TAG = f'py{PY_VERSION[0]}'
+    _PY_ABI_TAG = f'abi{PY_VERSION[0]}'
+    _PY_NUM = int(f'{PY_VERSION[0]}{PY_VERSION[1]}')
+    _IS_LINUX = 'linux' in PLATFORM
+    _IS_GLIBC = GLIBC[0] == 'glibc'
+    _GLIBC_VERSION = tuple(int(it) for it in GLIBC[1].split('.')[:2]) \
+        if _IS_GLIBC else None
+    _MUSL_TAG = f'musllinux_{MUSL_VERSION}_{PLATFORM_TYPE}'
+    _MANYLINUX_ARCH = PLATFORM_TYPE.lower()
+    _ENV_READY = True
+
 
 DISABLE_COLOR = False
 
+_FILE_RE = re.compile(
+    # wheel
+    r'^(?:(?P<wname>[^-]+)-'
+    r'(?P<wver>[^-]+)'
+    r'(?:-(?P<wbuild>\d[^-]*))?-'
+    r'(?P<wpy>[^-]+)-'
+    r'(?P<wabi>[^-]+)-'
+    r'(?P<wplat>[^-]+)\.whl'
+    # sdist
+    r'|(?P<sname>[\w.-]+)-(?P<sver>[\d.]+)\.tar\.gz)$'
+)
+_OPS = {
+    '>=': operator.ge,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '<': operator.lt
+}
+# Two-character operators have to be listed first
+_PYVER_COND_RE = re.compile(r'^\s*(>=|<=|==|!=|>|<)\s*([0-9.\*]+)\s*$')
+_SOURCE_URL_RE = re.compile(r'(https?://)(?:([^:]+):([^@]+)@)?(.*)', re.I)
+
 
 class PackageException(Exception): pass     # noqa
 
@@ -80,8 +171,14 @@ def die(message: str, exitcode: int = 1):
     sys.exit(exitcode)
 
 
+def load_toml(path: str) -> dict:
+    with open(path, 'rb') as fd:
+        return tomllib.load(fd)
+
+
 def get_current_platform() -> str:
-    global PLATFORM, GLIBC
+    if not _ENV_READY:
+        refresh_env()
     if 'linux' not in PLATFORM:
         return PLATFORM
     if not GLIBC or not GLIBC[0]:
@@ -91,22 +188,19 @@ def get_current_platform() -> str:
 
 
 class Package:
-    OPERATORS = {
-        '>': operator.gt,
-        '<': operator.lt,
-        '>=': operator.ge,
-        '<=': operator.le,
-        '==': operator.eq,
-        '!=': operator.ne
-    }
+    OPERATORS = _OPS
 
     def __init__(self, name: str, version: str, python_version: str,
                  files: [dict], repository: 'Repository' = None):
+        if not _ENV_READY:
+            refresh_env()
         self.name = name
         self.version = version
         self.is_require_build_package = False
         self.repository = repository
         self.__files = []
+        self.__first = None
+        self.__first_valid = False
         self.logs = []
         self.fatal_error = False
         self.hashes = []   # This is use by Pipenv
@@ -128,9 +222,9 @@ class Package:
         if self.fatal_error:
             color = '\033[31m' if not DISABLE_COLOR else ''
             icon = '\u2718'
-        filename = self.__files[0].get('file', '') if self.__files else ''
-        repo = self.__files[0]['repo'].name \
-            if self.__files and 'repo' in self.__files[0] else '-'
+        file = self.__get_first() or {}
+        filename = file.get('file', '')
+        repo = file['repo'].name if 'repo' in file else '-'
         print(f"{color}{icon} "
               f"{self.name.ljust(24)}\t"
               f"{self.version.ljust(12)}"
@@ -140,11 +234,11 @@ class Package:
             print(f"\t{color}{it}{reset}")
 
     def __get_first(self):
-        while self.__files and 'url' not in self.__files[0]:
-            self.__files.pop(0)
-        if not self.__files:
-            return None
-        return self.__files[0]
+        if self.__first_valid:
+            return self.__first
+        self.__first = next((it for it in self.__files if 'url' in it), None)
+        self.__first_valid = True
+        return self.__first
 
     @property
     def is_wheel_available(self) -> bool:
@@ -179,101 +273,107 @@ class Package:
             py_version = '.'.join([str(it) for it in PY_VERSION])
             cond = python_version.replace('python_version', f"'{py_version}'")
             return eval(cond)
-        ops = '|'.join(self.OPERATORS.keys())
-        regx = re.compile(rf'^\s*(?P<op>{ops})\s*(?P<num>[0-9\\.\\*]+)\s*$')
+        conditions = self.parse_python_version(python_version)
+        if conditions is None:
+            return False
+        py_version = [*PY_VERSION]
+        return all(op(py_version[:-1] if wildcard else py_version, nums)
+                   for op, nums, wildcard in conditions)
+
+    @staticmethod
+    def parse_python_version(python_version: str) -> [tuple]:
+        """
+        Parse conditions (e.g. '>=3.7,<4.0') into (operator, numbers,
+        wildcard) triples. Returns None for an unsupported condition.
+        """
+        conditions = []
         for cond in python_version.split(','):
-            reg = regx.match(cond)
+            reg = _PYVER_COND_RE.match(cond)
             if not reg:
-                return False
-            op = self.OPERATORS[reg.group('op')]
-            nums = reg.group('num').split('.')
-            py_version = [*PY_VERSION]
-            if nums[-1] == '*':
+                return None
+            nums = reg.group(2).split('.')
+            wildcard = nums[-1] == '*'
+            if wildcard:
                 nums.pop(-1)
-                py_version.pop(-1)
-            nums = [int(it) for it in nums]
-            if not op(py_version, nums):
-                return False
-        return True
+            conditions.append((_OPS[reg.group(1)],
+                               [int(it) for it in nums], wildcard))
+        return conditions
 
     def manylinux_tag_is_compatible(self, tag):
+        if not _IS_GLIBC:
+            return False
         # Normalize and parse the tag
         tag = LEGACY_ALIASES.get(tag, tag)
-        m = re.match("manylinux_([0-9]+)_([0-9]+)_(.*)", tag)
-        if not m:
+        if not tag.startswith('manylinux_'):
             return False
-        tag_major_str, tag_minor_str, tag_arch = m.groups()
-        tag_major = int(tag_major_str)
-        tag_minor = int(tag_minor_str)
-
-        if GLIBC[0] != 'glibc':
+        parts = tag.split('_', 3)
+        if len(parts) != 4:
+            return False
+        _, tag_major, tag_minor, tag_arch = parts
+        try:
+            tag_version = (int(tag_major), int(tag_minor))
+        except ValueError:
             return False
-        sys_major, sys_minor = GLIBC[1].split('.')
-        sys_major = int(sys_major)
-        sys_minor = int(sys_minor)
 
-        if (sys_major, sys_minor) < (tag_major, tag_minor):
+        if _GLIBC_VERSION < tag_version:
             return False
 
-        if PLATFORM_TYPE.lower() != tag_arch:
+        if _MANYLINUX_ARCH != tag_arch:
             return False
         return True
 
+    def platform_tag_is_compatible(self, package_platform):
+        if package_platform == 'any' or PLATFORM == package_platform:
+            return True
+        # platform is equal manylinux or musllinux
+        if not _IS_LINUX:
+            return False
+        if _IS_GLIBC:
+            # manylinux
+            if 'manylinux' not in package_platform:
+                return False
+            return any(self.manylinux_tag_is_compatible(it)
+                       for it in package_platform.split('.'))
+        # musllinux
+        return _MUSL_TAG == package_platform
+
     def set_files(self, files: [dict]):
-        py_lang = f'{PYIMPL}{PY_VERSION[0]}{PY_VERSION[1]}'
         source_package = None
         is_binary_package = False
-        self.__files = []
+        wheels = []
         for file in files:
-            match = re.match(
-                r'^(?P<name>[\w.-]+)-'
-                r'(?P<version>\d[^-]+)-'
-                r'((?P<build_tag>\d[^-]*)-)?'
-                r'(?P<python_tag>[^-]+)-'
-                r'(?P<abi_tag>[^-]+)-'
-                r'(?P<platform>.+)\.whl$',
-                file.get('file'))
-            if match:
-                is_binary_package = True
-                parsed = match.groupdict()
-                package_tag = parsed['python_tag']
-                abi_tag = parsed['abi_tag']
-                if package_tag != 'none':
-                    if f'py{PY_VERSION[0]}' not in package_tag and \
-                            py_lang != package_tag:
-                        try:
-                            np = int(re.search(r'(\d+)', package_tag)
-                                     .group(1))
-                            nl = int(f'{PY_VERSION[0]}{PY_VERSION[1]}')
-                        except Exception:
-                            np = 1
-                            nl = 0
-                        if abi_tag != f'abi{PY_VERSION[0]}' or nl < np:
-                            continue
-                package_platform = parsed['platform']
-                if package_platform != 'any' and PLATFORM != package_platform:
-                    # platform is equal manylinux or musllinux
-                    if 'linux' not in PLATFORM:
+            filename = file.get('file')
+            if filename.endswith('.whl') and not \
+                    self.platform_tag_is_compatible(
+                        filename[:-4].rsplit('-', 1)[-1]):
+                # Skip the full filename parsing for foreign platforms
+                if not is_binary_package and _FILE_RE.match(filename):
+                    is_binary_package = True
+                continue
+            match = _FILE_RE.match(filename)
+            if not match:
+                continue
+            if match.group('sname'):
+                source_package = file
+                continue
+            is_binary_package = True
+            package_tag = match.group('wpy')
+            abi_tag = match.group('wabi')
+            if package_tag != 'none':
+                if _PY_MAJOR_TAG not in package_tag and \
+                        _PY_LANG != package_tag:
+                    try:
+                        np = int(re.search(r'(\d+)', package_tag).group(1))
+                    except Exception:
                         continue
-
-                    if GLIBC[0] == 'glibc':
-                        # manylinux
-                        if 'manylinux' not in package_platform:
-                            continue
-
-                        if not any([self.manylinux_tag_is_compatible(it)
-                                    for it in package_platform.split('.')]):
-                            continue
-                    elif (f'musllinux_{MUSL_VERSION}'
-                          f'_{PLATFORM_TYPE}' != package_platform):
-                        # musllinux
+                    if abi_tag != _PY_ABI_TAG or _PY_NUM < np:
                         continue
-                self.__files.insert(0, file)
-            else:
-                if re.match(r'^[\w.-]+-[\d.]+\.tar\.gz',
-                            file.get('file')):
-                    source_package = file
+            wheels.append(file)
 
+        # The last listed wheel has the highest priority
+        wheels.reverse()
+        self.__files = wheels
+        self.__first_valid = False
         if source_package:
             self.__files.append(source_package)
             self.is_require_build_package = \
@@ -332,6 +432,7 @@ class Package:
                             self.logs.append(e_msg)
                         file['url'] = url['url']
                         file['repo'] = repo
+                        self.__first_valid = False
                         num_files -= 1
                         break
         # raise PackageException(
@@ -340,20 +441,46 @@ class Package:
         if not self.is_wheel_available and self.is_require_build_package:
             self.logs.append('This package requires a build.')
 
-    def download_package(self, target: str) -> None:
+    def download_package(self, target: str,
+                         cancel: threading.Event = None) -> None:
         file = self.__get_first()
         if file is None:
             raise PackageException(
                 f'The source lock file does not contain a correct reference '
                 f'for package "{self.name}" with required python version and '
                 f'CPU architecture.')
+        path = f'{target}/{file["file"]}'
         try:
-            response = file['repo'].get_url_response(file['url'])
-            with open(f'{target}/{file["file"]}', 'wb') as fd:
-                fd.write(response.read())
+            with file['repo'].get_url_response(file['url']) as response, \
+                    open(path, 'wb') as fd:
+                while not (cancel and cancel.is_set()):
+                    chunk = response.read(1024 * 1024)
+                    if not chunk:
+                        return
+                    fd.write(chunk)
         except urllib.error.HTTPError as e:
             raise PackageException(f'Can not download package {file["url"]}:'
                                    f' {e}')
+        # Aborted, do not leave an incomplete package behind
+        os.remove(path)
+
+
+class RepositoryPasswordMgr(urllib.request.HTTPPasswordMgrWithDefaultRealm):
+    """
+    Password manager shared by the download threads of a repository.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.__lock = threading.Lock()
+
+    def add_password(self, realm, uri, user, passwd):
+        with self.__lock:
+            super().add_password(realm, uri, user, passwd)
+
+    def find_user_password(self, realm, authuri):
+        with self.__lock:
+            return super().find_user_password(realm, authuri)
 
 
 class Repository:
@@ -373,12 +500,28 @@ class Repository:
         cls.INSTANCES[name] = repo
         return repo
 
+    @classmethod
+    def get_or_create(cls, name: str, url: str) -> 'Repository':
+        """
+        Get or create repository, the url is parsed only when it changes.
+        """
+        repo = cls.get(name) or cls.create(name)
+        if repo.source_url != url:
+            repo.set_url(url)
+        return repo
+
     def __init__(self, name: str, username: str = None, password: str = None,
                  url: str = None, legacy: bool = True, verify_ssl: bool = True):
         self.name = name
         self.username = username
         self.password = password
         self.url = None
+        self.source_url = None
+        self.__metadata = {}
+        self.__password_mgr = RepositoryPasswordMgr()
+        self.__opener = urllib.request.build_opener(
+            urllib.request.HTTPBasicAuthHandler(self.__password_mgr)
+        )
         self.set_url(url or 'https://pypi.org')
         self.legacy = legacy
         self.verify_ssl = verify_ssl
@@ -387,34 +530,28 @@ class Repository:
         return f'Repository<{self.name}>'
 
     def set_url(self, url):
-        match = re.match(
-            r'(?P<schema>https?:\/\/)((?P<username>[^:]+):'
-            r'(?P<password>[^@]+)@)?(?P<url>.*)',
-            url,
-            re.I
-        )
+        match = _SOURCE_URL_RE.match(url)
         if not match:
             raise PackageException(f'Invalid url "{url}"')
-        if match.group('username'):
-            self.username = match.group('username')
+        schema, username, password, address = match.groups()
+        if username:
+            self.username = username
         elif f'PYLF_{self.name.upper()}_USERNAME' in os.environ:
             self.username = os.getenv(f'PYLF_{self.name.upper()}_USERNAME')
-        if match.group('password'):
-            self.password = match.group('password')
+        if password:
+            self.password = password
         elif f'PYLF_{self.name.upper()}_PASSWORD' in os.environ:
             self.password = os.getenv(f'PYLF_{self.name.upper()}_PASSWORD')
-        self.url = f'{match.group("schema")}{match.group("url")}'
+        self.url = f'{schema}{address}'
+        self.source_url = url
 
     def get_url_response(self, url: str):
         if self.username:
-            password_mgr = urllib.request.HTTPPasswordMgrWithDefaultRealm()
-            password_mgr.add_password(None, url,
-                                      self.username, self.password)
-            auth_handler = urllib.request.HTTPBasicAuthHandler(password_mgr)
-            opener = urllib.request.build_opener(auth_handler)
-            return opener.open(url)
-        else:
-            return urllib.request.urlopen(url)
+            # Credentials are offered only for the requested url, not for
+            # the redirect targets.
+            self.__password_mgr.add_password(None, url,
+                                             self.username, self.password)
+        return self.__opener.open(url)
 
     def __legacy_parse(self, html: str):
         match = re.findall(
@@ -434,14 +571,23 @@ class Repository:
         return {'urls': res}
 
     def get_metadata(self, name: str, version: str) -> dict:
+        """
+        Metadata of the package, responses are cached per url.
+        """
+        if self.legacy:
+            url = f'{self.url}/{name}'
+        else:
+            url = f'{self.url}/pypi/{name}/{version}/json'
+        if url not in self.__metadata:
+            self.__metadata[url] = self.__fetch_metadata(url)
+        return self.__metadata[url]
+
+    def __fetch_metadata(self, url: str) -> dict:
         try:
+            response = self.get_url_response(url)
             if self.legacy:
-                response = self.get_url_response(f'{self.url}/{name}')
                 return self.__legacy_parse(response.read().decode('utf-8'))
             else:
-                response = self.get_url_response(
-                    f'{self.url}/pypi/{name}/{version}/json'
-                )
                 return json.loads(response.read())
         except urllib.error.HTTPError as e:
             if e.code == 401:
@@ -452,10 +598,24 @@ class Repository:
             return None
 
 
+def _resolve_repo(record: dict) -> 'Repository':
+    """
+    Repository of a lock file record, the default one if there is no source.
+    """
+    source = record.get('source')
+    if not source:
+        return Repository.get(Repository.DEFAULT_REPOSITORY)
+    repo = Repository.get_or_create(source['reference'], source['url'])
+    repo.verify_ssl = source.get('verify_ssl', True)
+    repo.legacy = source.get('type', '') == 'legacy'
+    return repo
+
+
 class SourceFile:
 
     SOURCE_FILES = []
     CREDENTIALS = {}
+    MAX_WORKERS = 16
 
     def __init__(self, lockfile_path: str):
         self.lockfile_path = lockfile_path
@@ -493,21 +653,38 @@ class SourceFile:
         if not kwargs['dryrun']:
             os.makedirs(kwargs['target'], exist_ok=True)
 
-        for pac in packages:
-            try:
-                pac.load_metadata(
-                    ignore_hash=kwargs['ignore_hash'],
-                    no_binary=kwargs['no_binary']
-                )
-                if not kwargs['dryrun']:
-                    pac.download_package(kwargs['target'])
-                pac.print_table_line()
-            except PackageException as ex:
-                if not kwargs['ignore_missing']:
-                    die(str(ex))
-                pac.logs.append(str(ex))
-                pac.fatal_error = True
-                pac.print_table_line()
+        # Set when the run is aborted, the pending packages are skipped
+        cancel = threading.Event()
+
+        def process(pac: Package) -> None:
+            if cancel.is_set():
+                return
+            pac.load_metadata(
+                ignore_hash=kwargs['ignore_hash'],
+                no_binary=kwargs['no_binary']
+            )
+            if not kwargs['dryrun'] and not cancel.is_set():
+                pac.download_package(kwargs['target'], cancel)
+
+        # Packages are processed concurrently, the output keeps their order.
+        executor = ThreadPoolExecutor(max_workers=self.MAX_WORKERS)
+        futures = [executor.submit(process, pac) for pac in packages]
+        try:
+            for pac, future in zip(packages, futures):
+                try:
+                    future.result()
+                    pac.print_table_line()
+                except PackageException as ex:
+                    if not kwargs['ignore_missing']:
+                        die(str(ex))
+                    pac.logs.append(str(ex))
+                    pac.fatal_error = True
+                    pac.print_table_line()
+        finally:
+            cancel.set()
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
 
 
 class PipenvLockfile(SourceFile):
@@ -569,16 +746,14 @@ class PoetryLockfile(SourceFile):
                            f'\\pypoetry\\auth.toml')
         if not os.path.exists(poetry_auth):
             return
-        with open(poetry_auth) as fd:
-            poetry = toml.load(fd)
-            for name, cred in poetry.get('http-basic', {}).items():
-                Repository.create(name, cred['username'], cred['password'])
+        poetry = load_toml(poetry_auth)
+        for name, cred in poetry.get('http-basic', {}).items():
+            Repository.create(name, cred['username'], cred['password'])
 
     def get_packages(self, package_groups: [str]) -> [Package]:
         groups = [self.DEFAULT_GROUP] + package_groups
         packages = []
-        with open(self.lockfile_path, 'r') as fd:
-            data = toml.load(fd)
+        data = load_toml(self.lockfile_path)
         for record in data.get('package', []):
             if record.get('category', self.DEFAULT_GROUP) not in groups:
                 continue
@@ -587,16 +762,7 @@ class PoetryLockfile(SourceFile):
                 'files',
                 data.get('metadata', {}).get('files', {}).get(name, [])
             )
-            repo = None
-            if 'source' in record:
-                repo = Repository.get(record['source']['reference'])
-                if not repo:
-                    repo = Repository.create(record['source']['reference'])
-                repo.set_url(record['source']['url'])
-                repo.verify_ssl = record['source'].get('verify_ssl', True)
-                repo.legacy = record['source'].get('type', '') == 'legacy'
-            if not repo:
-                repo = Repository.get(Repository.DEFAULT_REPOSITORY)
+            repo = _resolve_repo(record)
             if not repo:
                 die(f'Could not find repository for package {name}.')
             package = Package(
@@ -619,22 +785,20 @@ class PdmLockfile(SourceFile):
         pyproject = f'{dir}/pyproject.toml'
         if not os.path.exists(pyproject):
             return
-        with open(pyproject) as fd:
-            config = toml.load(fd)
-            for it in config.get('tool', {}).get('pdm', {}).get('source', []):
-                Repository.create(
-                    it['name'],
-                    it.get('username'),
-                    it.get('password'),
-                    url=it.get('url'),
-                    verify_ssl=it.get('verify_ssl', True)
-                )
+        config = load_toml(pyproject)
+        for it in config.get('tool', {}).get('pdm', {}).get('source', []):
+            Repository.create(
+                it['name'],
+                it.get('username'),
+                it.get('password'),
+                url=it.get('url'),
+                verify_ssl=it.get('verify_ssl', True)
+            )
 
     def get_packages(self, package_groups: [str]) -> [Package]:
         groups = set([self.DEFAULT_GROUP] + package_groups)
         packages = []
-        with open(self.lockfile_path, 'r') as fd:
-            data = toml.load(fd)
+        data = load_toml(self.lockfile_path)
         for record in data.get('package', []):
             if not groups.intersection(
                     record.get('groups', [self.DEFAULT_GROUP])):
@@ -717,11 +881,10 @@ PYTHON_IMPLEMENTATION:
                         )
 
     parser.add_argument('--platform',
-                        default=get_current_platform(),
                         action="store",
                         type=str,
                         help='Download packages for platform '
-                             '(default: %(default)s).'
+                             '(default: current platform).'
                         )
 
     parser.add_argument('--python-implementation',
@@ -756,21 +919,22 @@ PYTHON_IMPLEMENTATION:
             raise argparse.ArgumentTypeError("Unknown python version.")
         PY_VERSION = [int(it) for it in args.python_version.split('.')]
 
-    if args.platform:
-        parsed = args.platform.split('_')
-        if parsed[-1] == '64':
-            PLATFORM_TYPE = f'{parsed[-2]}_{parsed[-1]}'
-        else:
-            PLATFORM_TYPE = parsed[-1]
-        if 'manylinux' == parsed[0]:
-            PLATFORM = f'linux_{PLATFORM_TYPE}'
-            GLIBC = ('glibc', f'{parsed[1]}.{parsed[2]}')
-        elif 'musllinux' == parsed[0]:
-            PLATFORM = f'linux_{PLATFORM_TYPE}'
-            GLIBC = ('', '')
-            MUSL_VERSION = f'{parsed[1]}_{parsed[2]}'
-        else:
-            PLATFORM = args.platform
+    target_platform = args.platform or get_current_platform()
+    parsed = target_platform.split('_')
+    if parsed[-1] == '64':
+        PLATFORM_TYPE = f'{parsed[-2]}_{parsed[-1]}'
+    else:
+        PLATFORM_TYPE = parsed[-1]
+    if 'manylinux' == parsed[0]:
+        PLATFORM = f'linux_{PLATFORM_TYPE}'
+        GLIBC = ('glibc', f'{parsed[1]}.{parsed[2]}')
+    elif 'musllinux' == parsed[0]:
+        PLATFORM = f'linux_{PLATFORM_TYPE}'
+        GLIBC = ('', '')
+        MUSL_VERSION = f'{parsed[1]}_{parsed[2]}'
+    else:
+        PLATFORM = target_platform
+    refresh_env()
 
     # Create default repository
     Repository.create(Repository.DEFAULT_REPOSITORY, legacy=False)